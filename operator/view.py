@@ -7,25 +7,92 @@ import argparse
 import cv2
 import numpy as np
 import time
-from threading import Thread
-import queue
+from threading import Thread, Event, Lock
 import signal
 import hashlib
 import zmq
-import json
+import struct
 import collections
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Timestamp message published by the robot (17 bytes, little-endian): fingerprint code
+# (uint8, 0..31), send time (float64 seconds), frame id (int64, +1 per frame sent)
+TIMESTAMP_MESSAGE = struct.Struct('<Bdq')
+
+# Topics the robot publishes: the per-frame timestamp, and pipeline stats (JSON, every 5 s)
+TIMESTAMP_TOPIC = b'fp'
+STATS_TOPIC = b'stat'
+
+# Unix socket the robot also publishes timestamps on, used when both run on this machine
+ZMQ_IPC_ADDRESS = 'ipc:///tmp/avatar_fp.sock'
+
+# In-process endpoint used to wake the ZeroMQ receiver thread on shutdown
+ZMQ_CONTROL_ADDRESS = 'inproc://zmq-receiver-control'
+
+# Weight of each fingerprint square in the decoded counter (bit 0 first)
+FINGERPRINT_WEIGHTS = 1 << np.arange(5)
+
+# Row and column bounds (row_start, row_end, col_start, col_end) of each fingerprint square, by bit
+FINGERPRINT_TILES = np.array([
+    [0, 32, 0, 32],
+    [0, 32, 32, 64],
+    [32, 64, 0, 32],
+    [32, 64, 32, 64],
+    [64, 96, 0, 32],
+], dtype=np.int32)
+
+def _decode_fingerprint_numpy(frame):
+    """Decode the frame counter from the fingerprint squares using NumPy."""
+    # The fingerprint is a 3x2 grid of 32x32 squares in the top-left corner, so
+    # split that region into blocks and average each one in a single reduction.
+    # Row-major order of the blocks matches the bit order used by the robot.
+    blocks = frame[0:96, 0:64, :].reshape(3, 32, 2, 32, 3)
+    means = blocks.mean(axis=(1, 3, 4)).ravel()[:5]
+    bits = means.astype(np.int64) > 128
+    return int(np.dot(bits, FINGERPRINT_WEIGHTS))
+
+def _decode_fingerprint_loop(frame, tiles):
+    """Decode the frame counter with plain loops (compiled with Numba)."""
+    counter = 0
+    for bit in range(tiles.shape[0]):
+        r0, r1, c0, c1 = tiles[bit, 0], tiles[bit, 1], tiles[bit, 2], tiles[bit, 3]
+        total = 0
+        for y in range(r0, r1):
+            for x in range(c0, c1):
+                for c in range(3):
+                    total += frame[y, x, c]
+        
+        # Same as int(mean) > 128 without the division
+        if total >= (r1 - r0) * (c1 - c0) * 3 * 129:
+            counter |= 1 << bit
+    return counter
+
+if njit is not None:
+    _decode_fingerprint_jit = njit(cache=True)(_decode_fingerprint_loop)
+    
+    def decode_fingerprint(frame):
+        """Decode the frame counter from the fingerprint squares."""
+        return _decode_fingerprint_jit(frame, FINGERPRINT_TILES)
+else:
+    decode_fingerprint = _decode_fingerprint_numpy
+
 class LatencyCalculator:
     """Class to track video stream latency."""
     
     def __init__(self):
-        self.last_latencies = []  # Store last few latency values for smoothing
         self.max_samples = 10     # Number of samples to keep for averaging
+        self.last_latencies = collections.deque(maxlen=self.max_samples)  # Store last few latency values for smoothing
+        self.last_latencies_sum = 0.0  # Running sum of last_latencies
         self.last_time = time.time()
         
         # For true latency calculation
-        self.frame_timestamps = {}  # Store sent timestamps by frame_count
+        self.frame_timestamps = collections.OrderedDict()  # Store sent timestamps by frame_count, oldest first
         self.latency_values = collections.deque(maxlen=30)  # Store last 30 latency values
+        self.latency_values_sum = 0.0  # Running sum of latency_values
     
     def calculate_latency(self):
         """Calculate network latency based on frame arrival time."""
@@ -38,25 +105,23 @@ class LatencyCalculator:
         # We use this to monitor network performance
         latency_ms = 1000 / frame_time_diff if frame_time_diff > 0 else 0
         
-        # Add to history and keep only the latest samples
+        # Add to history, keeping only the latest samples and the running sum in step
+        if len(self.last_latencies) == self.max_samples:
+            self.last_latencies_sum -= self.last_latencies[0]
         self.last_latencies.append(latency_ms)
-        if len(self.last_latencies) > self.max_samples:
-            self.last_latencies.pop(0)
+        self.last_latencies_sum += latency_ms
             
         # Calculate average latency
-        if self.last_latencies:
-            avg_latency = sum(self.last_latencies) / len(self.last_latencies)
-            return avg_latency
-        return 0
+        return self.last_latencies_sum / len(self.last_latencies)
     
     def store_frame_timestamp(self, frame_count, timestamp):
         """Store timestamp for a given frame count."""
         self.frame_timestamps[frame_count] = timestamp
+        self.frame_timestamps.move_to_end(frame_count)
         
         # Clean up old timestamps (keep only last 100)
         if len(self.frame_timestamps) > 100:
-            oldest = min(self.frame_timestamps.keys())
-            self.frame_timestamps.pop(oldest)
+            self.frame_timestamps.popitem(last=False)
     
     def calculate_true_latency(self, frame_count):
         """Calculate true latency based on sent and received timestamps."""
@@ -65,11 +130,14 @@ class LatencyCalculator:
             received_time = time.time()
             latency_ms = (received_time - sent_time) * 1000  # Convert to milliseconds
             
-            # Store latency value
+            # Store latency value, keeping the running sum in step with the deque
+            if len(self.latency_values) == self.latency_values.maxlen:
+                self.latency_values_sum -= self.latency_values[0]
             self.latency_values.append(latency_ms)
+            self.latency_values_sum += latency_ms
             
             # Calculate average latency
-            avg_latency = sum(self.latency_values) / len(self.latency_values)
+            avg_latency = self.latency_values_sum / len(self.latency_values)
             
             return avg_latency, latency_ms
         return None, None
@@ -80,16 +148,46 @@ class VideoStreamReceiver:
     def __init__(self, config):
         self.config = config
         self.video_port = config['network']['video_port']
+        self.transport = config['network'].get('transport', 'udp')
+        self.srt_latency = config['network'].get('srt_latency_ms', 200)
         self.width = config['video']['width']
         self.height = config['video']['height']
         self.running = False
+        self.debug = config.get('debug', False)
         self.frame_count = 0
         self.start_time = time.time()
         self.latency_calc = LatencyCalculator()
-        self.frame_queue = queue.Queue(maxsize=10)
+        
+        # Preallocated frame buffers, rotated between the reader thread, the
+        # latest-frame slot and the display loop so that no buffer is ever
+        # written by the reader while it is being drawn on or shown
+        self.frame_buffers = [
+            np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(3)
+        ]
+        self.frame_lock = Lock()
+        
+        # Only the newest decoded frame is kept; older frames are dropped
+        self.latest_frame = self.frame_buffers[1]
+        
+        # Latency metrics (average, frame) of the last processed frame, and of the latest frame
+        self.frame_metrics = (None, None)
+        self.latest_metrics = (None, None)
+        self.new_frame = Event()
         self.zmq_messages_received = 0
         self.last_zmq_debug_time = time.time()
         
+        # Geometry fixed by the stream resolution: bytes per NV12 frame and
+        # the info overlay text positions in the bottom-right corner
+        self.frame_size = self.width * self.height * 3 // 2
+        self.overlay_x = self.width - 290
+        self.fps_pos = (self.overlay_x, self.height - 75)
+        self.frame_rate_pos = (self.overlay_x, self.height - 50)
+        self.avg_latency_pos = (self.overlay_x, self.height - 25)
+        self.frame_latency_pos = (self.overlay_x, self.height - 5)
+        
+        # Use NVDEC for decoding if this ffmpeg build supports it
+        self.hw_decoder = self._detect_hw_decoder()
+        
         # Initialize ZeroMQ context and subscriber socket
         try:
             print("Setting up ZeroMQ subscriber...")
@@ -98,7 +196,8 @@ class VideoStreamReceiver:
             
             # Connect to publisher (video_port + 1)
             self.zmq_port = self.video_port + 1
-            connect_address = f"tcp://{config['network']['operator_ip']}:{self.zmq_port}"
+            self.zmq_address = self._zmq_address()
+            connect_address = self.zmq_address
             print(f"Connecting to ZeroMQ publisher at {connect_address}")
             
             # Set socket options for better performance
@@ -108,45 +207,111 @@ class VideoStreamReceiver:
             # Connect to the publisher
             self.zmq_socket.connect(connect_address)
             
-            # Subscribe to all messages
-            self.zmq_socket.setsockopt_string(zmq.SUBSCRIBE, "")
-            print(f"ZeroMQ subscriber connected to {config['network']['operator_ip']}:{self.zmq_port}")
+            # Subscribe to the timestamps (and the robot's stats when debugging)
+            self._subscribe()
+            print(f"ZeroMQ subscriber connected to {connect_address}")
             
-            # Start ZeroMQ receiver thread
+            # Control socket used by stop() to wake the receiver thread immediately
+            self.zmq_control = self.zmq_context.socket(zmq.PAIR)
+            self.zmq_control.setsockopt(zmq.LINGER, 0)
+            self.zmq_control.bind(ZMQ_CONTROL_ADDRESS)
+            
+            # Create ZeroMQ receiver thread (started along with the stream)
             self.zmq_thread = Thread(target=self._receive_zmq_messages)
             self.zmq_thread.daemon = True
-            self.zmq_thread.start()
             
         except Exception as e:
             print(f"Error setting up ZeroMQ subscriber: {e}")
             import traceback
             traceback.print_exc()
+    
+    def _subscribe(self):
+        """Subscribe to the robot's timestamps, and its pipeline stats in debug mode."""
+        self.zmq_socket.setsockopt(zmq.SUBSCRIBE, TIMESTAMP_TOPIC)
+        if self.debug:
+            self.zmq_socket.setsockopt(zmq.SUBSCRIBE, STATS_TOPIC)
+    
+    def _zmq_address(self):
+        """Return the ZeroMQ endpoint to subscribe to: IPC if enabled, otherwise TCP."""
+        # Only opt-in: a robot in a container or another namespace has its own /tmp
+        if self.config['network'].get('zmq_ipc', False) and sys.platform != 'win32':
+            return ZMQ_IPC_ADDRESS
+        return f"tcp://{self.config['network']['operator_ip']}:{self.zmq_port}"
+    
+    def _detect_hw_decoder(self):
+        """Return the name of a hardware H.264 decoder that can decode a test frame, or None."""
+        # Builds can list h264_cuvid without an NVIDIA GPU or driver, so decode one frame
+        try:
+            encoded = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+                 '-f', 'lavfi', '-i', 'color=black:s=256x256', '-frames:v', '1',
+                 '-c:v', 'libx264', '-f', 'h264', '-'],
+                capture_output=True,
+                timeout=10
+            )
+            if encoded.returncode == 0:
+                result = subprocess.run(
+                    ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+                     '-hwaccel', 'cuda', '-c:v', 'h264_cuvid', '-f', 'h264', '-i', '-',
+                     '-f', 'null', '-'],
+                    input=encoded.stdout,
+                    capture_output=True,
+                    timeout=10
+                )
+                if result.returncode == 0:
+                    print("Using NVDEC hardware decoder (h264_cuvid)")
+                    return 'h264_cuvid'
+        except Exception as e:
+            print(f"Could not test hardware decoder: {e}")
+        
+        print("Using software decoder")
+        return None
         
     def start(self):
         """Start receiving and displaying the video stream."""
         self.running = True
         
+        # Start ZeroMQ receiver thread now that running is set
+        if hasattr(self, 'zmq_thread'):
+            self.zmq_thread.start()
+        
         # Start ffplay in a new process and pipe its output to a named pipe
         # Use external ffmpeg for decoding only (not binding to the port)
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-i', f'udp://@127.0.0.1:{self.video_port}?timeout=1000000&fifo_size=1000000',
+        ffmpeg_cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+        
+        # Decode on the GPU; frames are downloaded once by ffmpeg for the pipe
+        if self.hw_decoder:
+            ffmpeg_cmd += ['-hwaccel', 'cuda', '-c:v', self.hw_decoder]
+            
+        if self.transport == 'srt':
+            # Wait for the robot to connect; SRT recovers lost packets within the latency budget
+            input_url = (f'srt://127.0.0.1:{self.video_port}?mode=listener'
+                         f'&latency={self.srt_latency * 1000}&transtype=live')
+        else:
+            input_url = f'udp://@127.0.0.1:{self.video_port}?timeout=1000000&fifo_size=1000000'
+            
+        ffmpeg_cmd += [
+            '-i', input_url,
             '-f', 'rawvideo',
-            '-pix_fmt', 'bgr24',
+            '-pix_fmt', 'nv12',
             '-vsync', '0',
             '-flags', 'low_delay',
             '-fflags', 'nobuffer+discardcorrupt',
             '-'
         ]
         
-        # Start ffmpeg process with unbuffered output for maximum responsiveness
+        # Start ffmpeg process with unbuffered output for maximum responsiveness.
+        # Frames are read from the raw pipe straight into the staging buffer, so
+        # Python's own buffering would only add an extra copy. Errors go to the terminal.
         self.ffmpeg_process = subprocess.Popen(
             ffmpeg_cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            bufsize=10**8  # Large buffer to handle video data
+            bufsize=0
         )
         
+        # Let ffmpeg write a whole frame into the pipe before it has to wait for us
+        self._set_pipe_size(self.ffmpeg_process.stdout.fileno(), self.frame_size)
+        
         # Start the frame reader thread
         self.reader_thread = Thread(target=self._read_frames)
         self.reader_thread.daemon = True
@@ -155,39 +320,62 @@ class VideoStreamReceiver:
         # Start display loop
         self._display_loop()
     
+    def _set_pipe_size(self, fd, size):
+        """Grow a pipe's kernel buffer (Linux only), capped at the system maximum."""
+        if not sys.platform.startswith('linux'):
+            return
+        
+        import fcntl
+        F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+        try:
+            with open('/proc/sys/fs/pipe-max-size', 'r') as file:
+                size = min(size, int(file.read()))
+            fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+        except OSError as e:
+            print(f"Could not resize pipe: {e}")
+    
     def _receive_zmq_messages(self):
         """Receive ZeroMQ messages with frame timestamps."""
         last_connect_attempt = time.time()
         reconnect_interval = 5  # seconds
         
+        # Wait on the subscriber and the control socket together, so the thread
+        # sleeps until a message arrives, stop() wakes it, or it is time to reconnect
+        poller = zmq.Poller()
+        poller.register(self.zmq_socket, zmq.POLLIN)
+        poller.register(self.zmq_control, zmq.POLLIN)
+        
         print("ZeroMQ receiver thread started")
         
         while self.running:
             try:
-                # Use poll with timeout to prevent blocking indefinitely
-                # NOTE: zmq_socket.poll() returns a bitmask, not something that can be converted to a dict
-                poll_result = self.zmq_socket.poll(100)  # Poll with 100ms timeout
+                events = dict(poller.poll(reconnect_interval * 1000))
+                
+                if self.zmq_control in events:
+                    # Woken up by stop()
+                    break
                 
-                if poll_result & zmq.POLLIN:  # Check if POLLIN bit is set
-                    # Receive the message
-                    message = self.zmq_socket.recv_string()
+                if self.zmq_socket in events:
+                    # Receive the message: topic, then payload
+                    topic, message = self.zmq_socket.recv_multipart()
+                    if topic == STATS_TOPIC:
+                        print(f"Robot pipeline stats: {message.decode()}")
+                        continue
                     self.zmq_messages_received += 1
                     
-                    # Parse JSON
-                    data = json.loads(message)
+                    # Unpack binary message
+                    frame_count, timestamp, frame_id = TIMESTAMP_MESSAGE.unpack(message)
                     
                     # Store frame timestamp
-                    frame_count = data.get('frame_count')
-                    timestamp = data.get('timestamp')
-                    if frame_count is not None and timestamp is not None:
-                        self.latency_calc.store_frame_timestamp(frame_count, timestamp)
-                        
-                        # Print debug info every few seconds
+                    self.latency_calc.store_frame_timestamp(frame_count, timestamp)
+                    
+                    # Print debug info every few seconds
+                    if self.debug:
                         now = time.time()
                         if now - self.last_zmq_debug_time >= 5:
                             rate = self.zmq_messages_received / (now - self.last_zmq_debug_time)
                             print(f"ZMQ: Received {self.zmq_messages_received} messages at {rate:.1f} msg/sec")
-                            print(f"Latest frame count: {frame_count}, timestamp: {timestamp}")
+                            print(f"Latest frame id: {frame_id}, count: {frame_count}, timestamp: {timestamp}")
                             self.zmq_messages_received = 0
                             self.last_zmq_debug_time = now
                 else:
@@ -199,12 +387,15 @@ class VideoStreamReceiver:
                         # Try to reconnect
                         try:
                             # Close and recreate socket
+                            poller.unregister(self.zmq_socket)
                             self.zmq_socket.close()
                             self.zmq_socket = self.zmq_context.socket(zmq.SUB)
-                            connect_address = f"tcp://{self.config['network']['operator_ip']}:{self.zmq_port}"
+                            self.zmq_socket.setsockopt(zmq.LINGER, 0)
+                            connect_address = self.zmq_address
                             print(f"Reconnecting to {connect_address}")
                             self.zmq_socket.connect(connect_address)
-                            self.zmq_socket.setsockopt_string(zmq.SUBSCRIBE, "")
+                            self._subscribe()
+                            poller.register(self.zmq_socket, zmq.POLLIN)
                         except Exception as e:
                             print(f"Reconnection attempt failed: {e}")
                             
@@ -224,26 +415,42 @@ class VideoStreamReceiver:
         
     def _read_frames(self):
         """Read frames from ffmpeg output."""
-        frame_size = self.width * self.height * 3  # 3 bytes per pixel (BGR)
+        # ffmpeg sends NV12: a full resolution Y plane followed by an interleaved
+        # half resolution UV plane, 1.5 bytes per pixel instead of 3 for BGR
+        frame_size = self.frame_size
+        fd = self.ffmpeg_process.stdout.fileno()
+        
+        # Staging buffer for the raw NV12 frame, and a flat byte view of it
+        nv12_frame = np.empty((self.height * 3 // 2, self.width), dtype=np.uint8)
+        view = memoryview(nv12_frame).cast('B')
+        
+        # Buffer currently owned by the reader
+        frame = self.frame_buffers[0]
         
         while self.running:
             try:
-                # Read raw frame data
-                raw_frame = self.ffmpeg_process.stdout.read(frame_size)
+                # Read raw frame data straight into the staging buffer, looping over
+                # short reads from the pipe until the frame is complete or EOF
+                bytes_read = 0
+                while bytes_read < frame_size:
+                    n = os.readv(fd, [view[bytes_read:]])
+                    if n == 0:
+                        break
+                    bytes_read += n
                 
-                if len(raw_frame) == frame_size:
-                    # Convert to numpy array
-                    frame = np.frombuffer(raw_frame, np.uint8).reshape((self.height, self.width, 3))
-
-                    # Copy to make writable
-                    frame = np.array(frame)
-
+                if bytes_read == frame_size:
+                    # Convert to BGR directly into the frame buffer
+                    cv2.cvtColor(nv12_frame, cv2.COLOR_YUV2BGR_NV12, frame)
+                    
                     # Process frame
                     frame = self.process_frame(frame)
                     
-                    # Put in queue if not full
-                    if not self.frame_queue.full():
-                        self.frame_queue.put(frame)
+                    # Publish as the latest frame, taking back the buffer it replaces.
+                    # The event changes under the lock too, so it always matches the swap.
+                    with self.frame_lock:
+                        self.latest_frame, frame = frame, self.latest_frame
+                        self.latest_metrics = self.frame_metrics
+                        self.new_frame.set()
                 else:
                     # If we can't read a full frame, sleep a bit
                     time.sleep(0.001)
@@ -255,16 +462,11 @@ class VideoStreamReceiver:
         """Process frame before displaying it."""
 
         # Calculate the counter of the frame from the fingerprint
-        decoded_counter = 0
-        decoded_counter |= (1 << 0) if int(np.average(frame[0:32, 0:32, :])) > 128 else 0
-        decoded_counter |= (1 << 1) if int(np.average(frame[0:32, 32:64, :])) > 128 else 0
-        decoded_counter |= (1 << 2) if int(np.average(frame[32:64, 0:32, :])) > 128 else 0
-        decoded_counter |= (1 << 3) if int(np.average(frame[32:64, 32:64, :])) > 128 else 0
-        decoded_counter |= (1 << 4) if int(np.average(frame[64:96, 0:32, :])) > 128 else 0
+        decoded_counter = decode_fingerprint(frame)
 
         # Calculate true latency based on ZeroMQ timestamps
         avg_latency, frame_latency = self.latency_calc.calculate_true_latency(decoded_counter)
-        
+        self.frame_metrics = (avg_latency, frame_latency)
         
         # Add text with proper None handling
         cv2.putText(frame, f"Decoded counter: {decoded_counter}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
@@ -290,54 +492,61 @@ class VideoStreamReceiver:
     def _display_loop(self):
         """Display frames with FPS counter."""
         last_time = time.time()
-        fps = 0
+        fps_text = "0.0"
         window_name = 'Avatar Operator Viewer'
         
+        # Buffer currently owned by the display loop
+        frame = self.frame_buffers[2]
+        waiting = False
+        
         # Create window and set properties
         cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
         
         try:
             while self.running:
-                try:
-                    # Try to get a frame with timeout
-                    frame = self.frame_queue.get(timeout=1.0)
-                    
-                    # Update frame counter
-                    self.frame_count += 1
-                    current_time = time.time()
-                    time_diff = current_time - last_time
-                    
-                    # Update FPS calculation every second
-                    if time_diff >= 1.0:
-                        fps = self.frame_count / time_diff
-                        self.frame_count = 0
-                        last_time = current_time
-                    
-                    # Calculate frame rate (from original latency calculator)
-                    frame_rate = self.latency_calc.calculate_latency()
-                    
-                    # Get true latency from frame (safe default to 0 if not available)
-                    true_latency = getattr(frame, 'latency', 0)
-                    frame_latency = getattr(frame, 'frame_latency', 0)
-                    
-                    # Add info overlay with both metrics
-                    self._add_info_overlay(frame, fps, frame_rate, true_latency, frame_latency)
-                    
-                    # Display the frame
-                    cv2.imshow(window_name, frame)
-                    
-                    # Check for key press to exit
-                    key = cv2.waitKey(1) & 0xFF
-                    if key == ord('q'):
-                        self.running = False
-                        break
-                        
-                except queue.Empty:
-                    # If no frames available, wait
-                    print("No frames available. Waiting for stream...")
-                    time.sleep(0.1)
+                # Wait for a new frame with timeout
+                if not self.new_frame.wait(timeout=1.0):
+                    # If no frames available, wait (report once, or every second when debugging)
+                    if not waiting or self.debug:
+                        print("No frames available. Waiting for stream...")
+                    waiting = True
                     continue
-                        
+                waiting = False
+                
+                # Take the frame and clear the event together, so a frame published
+                # meanwhile is neither missed nor taken twice
+                with self.frame_lock:
+                    self.new_frame.clear()
+                    frame, self.latest_frame = self.latest_frame, frame
+                    true_latency, frame_latency = self.latest_metrics
+                
+                # Update frame counter
+                self.frame_count += 1
+                current_time = time.time()
+                time_diff = current_time - last_time
+                
+                # Update FPS calculation (and its text) every second
+                if time_diff >= 1.0:
+                    fps = self.frame_count / time_diff
+                    fps_text = f"{fps:.1f}"
+                    self.frame_count = 0
+                    last_time = current_time
+                
+                # Calculate frame rate (from original latency calculator)
+                frame_rate = self.latency_calc.calculate_latency()
+                
+                # Add info overlay with both metrics
+                self._add_info_overlay(frame, fps_text, frame_rate, true_latency, frame_latency)
+                
+                # Display the frame
+                cv2.imshow(window_name, frame)
+                
+                # Check for key press to exit
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    self.running = False
+                    break
+                    
         except KeyboardInterrupt:
             print("\nViewer interrupted by user. Stopping...")
         except Exception as e:
@@ -347,80 +556,50 @@ class VideoStreamReceiver:
         finally:
             self.stop()
     
-    def _add_info_overlay(self, frame, fps, frame_rate, true_latency, frame_latency):
+    def _add_info_overlay(self, frame, fps_text, frame_rate, true_latency, frame_latency):
         """Add information overlay to the frame."""
-        # Add background for better readability
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (frame.shape[1] - 300, frame.shape[0] - 100), 
-                     (frame.shape[1], frame.shape[0]), (0, 0, 0), -1)
-        
-        # Blend the overlay with the frame
+        # Darken the overlay corner for better readability, touching only that region.
+        # Blending black at alpha is the same as scaling the pixels by (1 - alpha).
         alpha = 0.7
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
+        roi = frame[-100:, -300:]
+        cv2.convertScaleAbs(roi, roi, 1 - alpha)
         
         # Add FPS text
-        cv2.putText(
-            frame, 
-            f"FPS: {fps:.1f}", 
-            (frame.shape[1] - 290, frame.shape[0] - 75),
-            cv2.FONT_HERSHEY_SIMPLEX, 
-            0.6, 
-            (0, 255, 0),
-            2
-        )
+        cv2.putText(frame, f"FPS: {fps_text}", self.fps_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         
         # Add frame rate text
-        cv2.putText(
-            frame, 
-            f"Frame rate: {frame_rate:.1f} fps", 
-            (frame.shape[1] - 290, frame.shape[0] - 50),
-            cv2.FONT_HERSHEY_SIMPLEX, 
-            0.6, 
-            (0, 255, 0) if frame_rate > 25 else (0, 165, 255) if frame_rate > 15 else (0, 0, 255),
-            2
-        )
+        color = (0, 255, 0) if frame_rate > 25 else (0, 165, 255) if frame_rate > 15 else (0, 0, 255)
+        cv2.putText(frame, f"Frame rate: {frame_rate:.1f} fps", self.frame_rate_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
         
         # Add true latency text (with None check)
-        latency_color = (0, 255, 0) if true_latency < 100 else (0, 165, 255) if true_latency < 200 else (0, 0, 255)
-        if true_latency:
+        if true_latency is not None:
             # Only show latency if we have valid data
-            cv2.putText(
-                frame, 
-                f"Avg latency: {true_latency:.1f} ms", 
-                (frame.shape[1] - 290, frame.shape[0] - 25),
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.6, 
-                latency_color,
-                2
-            )
+            latency_color = (0, 255, 0) if true_latency < 100 else (0, 165, 255) if true_latency < 200 else (0, 0, 255)
+            cv2.putText(frame, f"Avg latency: {true_latency:.1f} ms", self.avg_latency_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.6, latency_color, 2)
             
             # Add frame latency
-            cv2.putText(
-                frame, 
-                f"Frame latency: {frame_latency:.1f} ms", 
-                (frame.shape[1] - 290, frame.shape[0] - 5),
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.5, 
-                latency_color,
-                1
-            )
+            cv2.putText(frame, f"Frame latency: {frame_latency:.1f} ms", self.frame_latency_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.5, latency_color, 1)
         else:
             # Show waiting message
-            cv2.putText(
-                frame, 
-                "Waiting for latency data...", 
-                (frame.shape[1] - 290, frame.shape[0] - 25),
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.6, 
-                (0, 165, 255),
-                2
-            )
+            cv2.putText(frame, "Waiting for latency data...", self.avg_latency_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 165, 255), 2)
     
     def stop(self):
         """Stop the stream receiver."""
         self.running = False
         
-        # Close ZeroMQ socket
+        # Wake the ZeroMQ receiver thread and wait for it to exit
+        if hasattr(self, 'zmq_thread') and self.zmq_thread.is_alive():
+            try:
+                waker = self.zmq_context.socket(zmq.PAIR)
+                waker.setsockopt(zmq.LINGER, 0)
+                waker.connect(ZMQ_CONTROL_ADDRESS)
+                waker.send(b'stop')
+                waker.close()
+            except Exception as e:
+                print(f"Error waking ZeroMQ receiver thread: {e}")
+            self.zmq_thread.join(timeout=1)
+        
+        # Close ZeroMQ sockets
         if hasattr(self, 'zmq_socket'):
             try:
                 self.zmq_socket.close()
@@ -428,6 +607,9 @@ class VideoStreamReceiver:
             except Exception as e:
                 print(f"Error closing ZeroMQ socket: {e}")
                 
+        if hasattr(self, 'zmq_control'):
+            self.zmq_control.close()
+                
         if hasattr(self, 'zmq_context'):
             try:
                 self.zmq_context.term()
@@ -447,8 +629,10 @@ class VideoStreamReceiver:
 
 def load_config(config_path):
     """Load configuration from YAML file."""
+    # libyaml's C loader when PyYAML was built with it, else the pure-Python one
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(config_path, 'r') as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=loader)
 
 # Signal handler for clean exit
 def cleanup_on_exit(signal, frame):
@@ -10,13 +10,151 @@ import time
 import threading
 import datetime
 import select
+import selectors
 import socket
+import ctypes
+import ctypes.util
+import errno
+import signal
+import struct
 from pathlib import Path
 
+# recvmmsg(2) structures from <sys/socket.h> and <sys/uio.h> (Linux)
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', _MsgHdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+MSG_DONTWAIT = 0x40
+MSG_WAITFORONE = 0x10000
+
+SPLICE_F_MOVE = 0x1
+SPLICE_F_MORE = 0x4
+
 def load_config(config_path):
     """Load configuration from YAML file."""
+    # libyaml's C loader when PyYAML was built with it, else the pure-Python one
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(config_path, 'r') as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=loader)
+
+class BatchReceiver:
+    """Receives many UDP datagrams per system call with recvmmsg(2) (Linux only)."""
+    
+    def __init__(self, sock, count=64, size=2048):
+        """Preallocate room for `count` datagrams of up to `size` bytes each."""
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._recvmmsg = libc.recvmmsg
+        self._recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        self._recvmmsg.restype = ctypes.c_int
+        
+        self.fd = sock.fileno()
+        self.count = count
+        self.size = size
+        
+        # One contiguous buffer that the kernel writes all datagrams into
+        self.buffer = bytearray(count * size)
+        self.view = memoryview(self.buffer)
+        self._c_buffer = (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        base = ctypes.addressof(self._c_buffer)
+        
+        self.iovecs = (_IOVec * count)()
+        self.msgs = (_MMsgHdr * count)()
+        for i in range(count):
+            self.iovecs[i].iov_base = base + i * size
+            self.iovecs[i].iov_len = size
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+    
+    @staticmethod
+    def available():
+        """Check whether recvmmsg can be used on this platform."""
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            return hasattr(ctypes.CDLL(ctypes.util.find_library('c')), 'recvmmsg')
+        except OSError:
+            return False
+    
+    def receive(self, wait=False):
+        """Return views of the queued datagrams, valid until the next call.
+        
+        With wait=True the call blocks (up to the socket's SO_RCVTIMEO) until the first
+        datagram arrives and then takes whatever else is queued. ctypes releases the
+        GIL for the whole call.
+        """
+        flags = MSG_WAITFORONE if wait else MSG_DONTWAIT
+        received = self._recvmmsg(self.fd, self.msgs, self.count, flags, None)
+        if received < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+        
+        return [
+            self.view[i * self.size:i * self.size + self.msgs[i].msg_len]
+            for i in range(received)
+        ]
+
+class SplicePump:
+    """Moves UDP datagrams from a socket into a pipe with splice(2), so the payload
+    never passes through Python (Linux only)."""
+    
+    def __init__(self, sock, pipe_fd, count=64):
+        """Move up to `count` datagrams from `sock` into `pipe_fd` per call."""
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._splice = libc.splice
+        self._splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+        self._splice.restype = ctypes.c_ssize_t
+        
+        self.fd = sock.fileno()
+        self.pipe_fd = pipe_fd
+        self.count = count
+    
+    @staticmethod
+    def available():
+        """Check whether splice can be used on this platform."""
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            return hasattr(ctypes.CDLL(ctypes.util.find_library('c')), 'splice')
+        except OSError:
+            return False
+    
+    def pump(self):
+        """Move the datagrams queued on the (non-blocking) socket; return the bytes moved.
+        
+        Raises OSError with EINVAL where the kernel cannot splice from UDP sockets.
+        """
+        moved = 0
+        for _ in range(self.count):
+            # One datagram per call; blocks only while the pipe is full, like a write
+            n = self._splice(self.fd, None, self.pipe_fd, None, 65536, SPLICE_F_MOVE | SPLICE_F_MORE)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise OSError(err, os.strerror(err))
+            moved += n
+        return moved
 
 class StreamRecorder:
     """Captures video stream and saves it to a file."""
@@ -28,6 +166,8 @@ class StreamRecorder:
         self.height = config['video']['height']
         self.framerate = config['video']['framerate']
         self.video_port = config['network']['video_port']
+        self.transport = config['network'].get('transport', 'udp')
+        self.srt_latency = config['network'].get('srt_latency_ms', 200)
         self.running = False
         self.frame_count = 0
         self.start_time = time.time()
@@ -50,6 +190,18 @@ class StreamRecorder:
         # UDP socket for receiving
         self.sock = None
         
+        # Reusable receive buffer for the recv_into fallback: one 2 KiB slot per
+        # datagram of a drained burst (MPEG-TS datagrams are 1316 bytes)
+        self._rx_slot = 2048
+        self._rx_buf = bytearray(64 * self._rx_slot)
+        self._rx_view = memoryview(self._rx_buf)
+        
+        # Received packets are coalesced here and written to FFmpeg about 40 at a time
+        self._wbuf = bytearray(64 * 1024)
+        self._wview = memoryview(self._wbuf)
+        self._wpos = 0
+        self._write_chunk = 40 * 1316
+        
     def setup_socket(self):
         """Setup UDP socket for receiving without binding exclusively."""
         # Create UDP socket
@@ -59,6 +211,9 @@ class StreamRecorder:
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         if hasattr(socket, 'SO_REUSEPORT'):  # Not available on all platforms
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        # Large receive buffer so bursts are not dropped; MPEG-TS over UDP has no retransmit
+        self._set_receive_buffer(7 * 1024 * 1024)
             
         # Bind to all interfaces
         try:
@@ -77,7 +232,7 @@ class StreamRecorder:
                     self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
                     
                 # Set larger buffer
-                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16*1024*1024)
+                self._set_receive_buffer(16 * 1024 * 1024)
                 
                 # Try joining a multicast group to get packets
                 # This is a workaround to receive UDP packets when port is already bound
@@ -88,14 +243,39 @@ class StreamRecorder:
                 print(f"Alternative socket method failed: {e2}")
                 return False
     
+    def _set_receive_buffer(self, size):
+        """Set the socket receive buffer size and warn if the OS caps it."""
+        # On Linux, SO_RCVBUFFORCE ignores net.core.rmem_max but needs CAP_NET_ADMIN
+        try:
+            if sys.platform.startswith('linux'):
+                self.sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_RCVBUFFORCE', 33), size)
+            else:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        except OSError:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        
+        # Linux reports double the size it applied (the extra is bookkeeping), so halve it
+        applied = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if sys.platform.startswith('linux'):
+            applied //= 2
+        if applied < size:
+            print(f"Warning: UDP receive buffer is {applied} bytes, requested {size}")
+            print("Increase the system limit (e.g. sysctl -w net.core.rmem_max=104857600) to avoid packet loss")
+    
     def start(self):
         """Start capturing and recording the stream."""
         self.running = True
         
-        # Setup reception socket
-        if not self.setup_socket():
-            print("Failed to setup reception socket, cannot continue")
-            return False
+        if self.transport == 'srt':
+            # FFmpeg accepts the SRT connection itself, so no packets pass through Python
+            input_url = (f"srt://0.0.0.0:{self.video_port}?mode=listener"
+                         f"&latency={self.srt_latency * 1000}&transtype=live")
+        else:
+            # Setup reception socket
+            if not self.setup_socket():
+                print("Failed to setup reception socket, cannot continue")
+                return False
+            input_url = "pipe:0"
             
         # Set up a temporary file for storing received UDP data
         temp_file = self.output_dir / "temp_udp_stream.ts"
@@ -104,9 +284,14 @@ class StreamRecorder:
         ffmpeg_cmd = [
             "ffmpeg",
             "-y",  # Overwrite output file
-            "-re",  # Read input at native frame rate (for pipes)
-            "-fflags", "nobuffer",  # Reduce buffering for lower latency
-            "-i", "pipe:0",  # Read from stdin
+            "-fflags", "nobuffer+discardcorrupt",  # Reduce buffering, drop damaged packets
+            "-flags", "low_delay",
+            "-max_delay", "0",  # Do not hold packets back for reordering
+            # Probe no longer than one keyframe interval: the mp4 muxer needs the frame
+            # size from the first SPS, which the robot only sends with keyframes (-g 2 s)
+            "-probesize", "1000000",
+            "-analyzeduration", "2000000",
+            "-i", input_url,  # Read from stdin, or from SRT directly
             "-c:v", "copy",  # Copy video stream without re-encoding
             "-movflags", "faststart",  # Optimize for streaming
             "-reset_timestamps", "1",  # Reset timestamps
@@ -120,26 +305,47 @@ class StreamRecorder:
         # Start FFmpeg process with pipe for input
         self.ffmpeg_process = subprocess.Popen(
             ffmpeg_cmd,
-            stdin=subprocess.PIPE,
+            stdin=subprocess.DEVNULL if self.transport == 'srt' else subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=10**8  # Large buffer
+            stderr=subprocess.PIPE
         )
         
-        # Create a thread to monitor FFmpeg stderr output
-        stderr_thread = threading.Thread(target=self._monitor_ffmpeg_stderr)
-        stderr_thread.daemon = True
-        stderr_thread.start()
+        if self.transport != 'srt':
+            # Write packets straight to the pipe's file descriptor, coalesced into
+            # large writes rather than one per datagram
+            self._stdin_fd = self.ffmpeg_process.stdin.fileno()
+            self._set_pipe_size(self._stdin_fd, 1024 * 1024)
+            
+            # Create a thread to handle UDP reception and pipe to FFmpeg
+            udp_thread = threading.Thread(target=self._receive_and_pipe)
+            udp_thread.daemon = True
+            udp_thread.start()
+        
+        # The main thread watches FFmpeg's stderr and, where supported, a pidfd that
+        # becomes readable when FFmpeg exits, so it sleeps until one of them has news
+        selector = selectors.DefaultSelector()
+        stderr_fd = self.ffmpeg_process.stderr.fileno()
+        os.set_blocking(stderr_fd, False)
+        selector.register(stderr_fd, selectors.EVENT_READ)
+        self._stderr_partial = b''
         
-        # Create a thread to handle UDP reception and pipe to FFmpeg
-        udp_thread = threading.Thread(target=self._receive_and_pipe)
-        udp_thread.daemon = True
-        udp_thread.start()
+        pidfd = self._open_pidfd(self.ffmpeg_process.pid)
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+        
+        next_report = time.time() + 10
         
         try:
             # Monitor the process
             while self.running and self.ffmpeg_process.poll() is None:
-                time.sleep(1)
+                # Without a pidfd, check on FFmpeg every second
+                timeout = max(0, next_report - time.time())
+                if pidfd is None:
+                    timeout = min(timeout, 1)
+                    
+                for key, _ in selector.select(timeout):
+                    if key.fd == stderr_fd and not self._read_ffmpeg_stderr(stderr_fd):
+                        selector.unregister(stderr_fd)
                 
                 # Check if FFmpeg is still running
                 if self.ffmpeg_process.poll() is not None:
@@ -149,15 +355,18 @@ class StreamRecorder:
                 
                 # Print recording duration every 10 seconds
                 current_time = time.time()
-                elapsed = current_time - self.start_time
-                if int(elapsed) > 0 and int(elapsed) % 10 == 0:
-                    print(f"Recording in progress... {elapsed:.0f} seconds")
+                if current_time >= next_report:
+                    print(f"Recording in progress... {current_time - self.start_time:.0f} seconds")
+                    next_report += 10
         
         except KeyboardInterrupt:
             print("\nRecording interrupted by user")
         except Exception as e:
             print(f"Error during recording: {e}")
         finally:
+            selector.close()
+            if pidfd is not None:
+                os.close(pidfd)
             self.stop()
             
         return True
@@ -168,50 +377,157 @@ class StreamRecorder:
         bytes_received = 0
         last_report_time = time.time()
         
+        # Splice datagrams straight into FFmpeg's pipe where the kernel allows it, else
+        # receive them in batches with recvmmsg where available
+        splice_pump = SplicePump(self.sock, self._stdin_fd) if SplicePump.available() else None
+        batch_receiver = BatchReceiver(self.sock) if BatchReceiver.available() else None
+        self._set_socket_mode(batch_receiver if not splice_pump else None)
+        
+        # Resolve the per-wakeup calls once, outside the receive loop
+        poll = self.ffmpeg_process.poll
+        flush_writes = self._flush_writes
+        wbuf_size = len(self._wbuf)
+        flush_deadline = None
+        
         while self.running:
             try:
-                # Check if socket ready to read (with timeout)
-                ready = select.select([self.sock], [], [], 0.5)
+                packets = []
+                ffmpeg_running = poll() is None
                 
-                # If socket has data
-                if self.sock in ready[0]:
-                    # Receive UDP packet
-                    data, addr = self.sock.recvfrom(65536)  # Max UDP packet size
+                if batch_receiver and not splice_pump:
+                    # Up to one batch per wakeup, as each call reuses the same buffer
+                    packets = batch_receiver.receive(wait=True)
+                else:
+                    # Check if socket ready to read (with timeout)
+                    ready = select.select([self.sock], [], [], 0.5)
                     
-                    # If data received and process still running
-                    if data and self.ffmpeg_process and self.ffmpeg_process.poll() is None:
-                        # Pipe data to FFmpeg
+                    # Drain the datagrams already queued on the socket, so one
+                    # wakeup handles a whole burst of packets
+                    if self.sock in ready[0] and splice_pump and ffmpeg_running:
                         try:
-                            self.ffmpeg_process.stdin.write(data)
-                            self.ffmpeg_process.stdin.flush()
-                            
-                            # Count bytes received
-                            bytes_received += len(data)
-                            
-                            # Report data rate every 5 seconds
-                            current_time = time.time()
-                            if current_time - last_report_time >= 5:
-                                data_rate = bytes_received / (current_time - last_report_time) / 1024
-                                print(f"Data rate: {data_rate:.2f} KB/s")
-                                bytes_received = 0
-                                last_report_time = current_time
-                                
-                        except BrokenPipeError:
-                            print("FFmpeg pipe broken, stopping")
-                            self.running = False
-                            break
-                            
+                            bytes_received += splice_pump.pump()
+                        except OSError as e:
+                            if e.errno != errno.EINVAL:
+                                raise
+                            # Kernels before 6.5 cannot splice from UDP sockets
+                            print("splice() is not supported for UDP sockets here, copying packets instead")
+                            splice_pump = None
+                            self._set_socket_mode(batch_receiver)
+                    elif self.sock in ready[0] and not splice_pump:
+                        # Receive into slots of the reusable buffer, without a new
+                        # bytes object or address tuple per datagram
+                        for offset in range(0, len(self._rx_buf), self._rx_slot):
+                            slot = self._rx_view[offset:offset + self._rx_slot]
+                            try:
+                                n = self.sock.recv_into(slot, self._rx_slot)
+                            except BlockingIOError:
+                                break
+                            packets.append(slot[:n])
+                
+                # If data received and process still running, queue it for FFmpeg
+                if packets and ffmpeg_running:
+                    for data in packets:
+                        n = len(data)
+                        if self._wpos + n > wbuf_size:
+                            flush_writes()
+                        self._wview[self._wpos:self._wpos + n] = data
+                        self._wpos += n
+                        
+                        # Count bytes received
+                        bytes_received += n
+                    if flush_deadline is None:
+                        flush_deadline = time.time() + 0.05
+                
+                # Write the queued packets once a chunk has built up, 50 ms have passed,
+                # or the socket went quiet
+                if self._wpos and (self._wpos >= self._write_chunk or not packets
+                                   or time.time() >= flush_deadline):
+                    flush_writes()
+                    flush_deadline = None
+                
+                # Report data rate every 5 seconds
+                current_time = time.time()
+                if current_time - last_report_time >= 5:
+                    data_rate = bytes_received / (current_time - last_report_time) / 1024
+                    print(f"Data rate: {data_rate:.2f} KB/s")
+                    bytes_received = 0
+                    last_report_time = current_time
+                    
+            except BrokenPipeError:
+                print("FFmpeg pipe broken, stopping")
+                self.running = False
+                break
             except Exception as e:
                 print(f"Error receiving UDP data: {e}")
                 time.sleep(0.1)
     
-    def _monitor_ffmpeg_stderr(self):
-        """Monitor FFmpeg's stderr for errors and important messages."""
-        # Read error output line by line
-        for line in iter(self.ffmpeg_process.stderr.readline, b''):
-            if not self.running:
-                break
-                
+    def _set_socket_mode(self, batch_receiver):
+        """Configure the socket for how _receive_and_pipe will read it."""
+        if batch_receiver:
+            # Wait inside recvmmsg itself rather than in select, so the thread only
+            # takes the GIL once per burst; the receive timeout lets it see self.running
+            self.sock.setblocking(True)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack('ll', 0, 500000))
+        else:
+            # Non-blocking, so the socket can be drained after each select wakeup
+            self.sock.setblocking(False)
+    
+    def _open_pidfd(self, pid):
+        """Return a pidfd for the process, or None where pidfd_open is not available."""
+        if not hasattr(os, 'pidfd_open'):
+            return None
+        try:
+            return os.pidfd_open(pid)
+        except OSError:
+            return None
+    
+    def _flush_writes(self):
+        """Write the coalesced packets to FFmpeg's stdin."""
+        self._write_packets([self._wview[:self._wpos]])
+        self._wpos = 0
+    
+    def _write_packets(self, packets):
+        """Write packets to FFmpeg's stdin with a single gather write where possible."""
+        packets = [memoryview(data) for data in packets]
+        while packets:
+            written = os.writev(self._stdin_fd, packets)
+            
+            # Drop what was written; a short write leaves part of a packet to resend
+            while packets and written >= len(packets[0]):
+                written -= len(packets[0])
+                packets.pop(0)
+            if packets and written:
+                packets[0] = packets[0][written:]
+    
+    def _set_pipe_size(self, fd, size):
+        """Grow a pipe's kernel buffer (Linux only), capped at the system maximum."""
+        if not sys.platform.startswith('linux'):
+            return
+        
+        import fcntl
+        F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+        try:
+            with open('/proc/sys/fs/pipe-max-size', 'r') as file:
+                size = min(size, int(file.read()))
+            fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+        except OSError as e:
+            print(f"Could not resize pipe: {e}")
+    
+    def _read_ffmpeg_stderr(self, fd):
+        """Print errors and important messages FFmpeg has written to stderr.
+        
+        Returns False once FFmpeg has closed stderr.
+        """
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return True
+        if not data:
+            return False
+        
+        # Progress lines end in a carriage return; keep any incomplete line for later
+        *lines, self._stderr_partial = (self._stderr_partial + data).replace(b'\r', b'\n').split(b'\n')
+        for line in lines:
             line = line.decode('utf-8', errors='replace').strip()
             
             # Only print crucial errors or stream info
@@ -221,6 +537,7 @@ class StreamRecorder:
             elif "Input #0" in line or "Stream mapping" in line:
                 print(f"FFmpeg: {line}")
                 print("Stream detected! Recording started.")
+        return True
     
     def stop(self):
         """Stop recording."""
@@ -247,6 +564,9 @@ class StreamRecorder:
                     self.ffmpeg_process.stdin.close()
                 except:
                     pass
+            else:
+                # Reading SRT itself, FFmpeg finishes the file on SIGINT
+                self.ffmpeg_process.send_signal(signal.SIGINT)
             
             # Wait for process to finish
             try:
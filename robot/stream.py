@@ -8,10 +8,40 @@ import argparse
 import cv2
 import numpy as np
 import time
+import json
+import collections
 import threading
+import queue
+import select
 import hashlib
 import zmq
-import json
+import struct
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = termios = None  # Windows: pipes keep their default size
+
+# Unix socket the timestamps are also published on, so a viewer on the same machine
+# skips the TCP stack (not available on Windows)
+ZMQ_IPC_ADDRESS = "ipc:///tmp/avatar_fp.sock"
+
+# Render node used for VAAPI encoding on Linux (Intel/AMD GPUs)
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# Top-left corner (row, column) of the 32x32 fingerprint square for each bit, bit 0 first.
+# Together they fill a 96x64 region except rows 64-96, columns 32-64.
+FINGERPRINT_SQUARES = ((0, 0), (0, 32), (32, 0), (32, 32), (64, 0))
+
+# Timestamp message sent for each frame (17 bytes, little-endian): fingerprint code
+# (uint8, 0..31), send time (float64 seconds), frame id (int64, +1 per frame sent)
+TIMESTAMP_MESSAGE = struct.Struct('<Bdq')
+
+# Topics on the ZeroMQ publisher: the per-frame timestamp, and pipeline stats
+# (JSON, every 5 seconds) for tuning queue sizes and encoder settings
+TIMESTAMP_TOPIC = b"fp"
+STATS_TOPIC = b"stat"
 
 class VideoStreamer:
     """Captures frames with OpenCV and streams them over the network."""
@@ -24,15 +54,46 @@ class VideoStreamer:
         self.framerate = config['video']['framerate']
         self.video_port = config['network']['video_port']
         self.operator_ip = config['network']['operator_ip']
+        self.transport = config['network'].get('transport', 'udp')
+        self.srt_latency = config['network'].get('srt_latency_ms', 200)
         self.running = False
-        self.frame_count = 0
-        self.start_time = time.time()
-        self.last_fps_print = time.time()
+        self.frame_count = 0  # Frames streamed since start; also the frame id sent over ZMQ
+        self._fp_code = 0  # Fingerprint shown on the current frame, 0..31
+        self._fps_frames = 0  # Frames since the last FPS print
+        # Stats are timed with the monotonic clock, which NTP adjustments cannot move;
+        # only the timestamps sent to the viewer use wall-clock time
+        self.start_time = time.monotonic()
+        self.last_fps_print = self.start_time
         self.zmq_messages_sent = 0
-        self.last_zmq_print = time.time()
+        # Frames not sent to ffmpeg because it was behind, counted separately by the two
+        # threads that drop them so neither increment can be lost (see dropped_frames)
+        self._queue_drops = 0  # Main thread: oldest frame dropped from a full write_q
+        self._pipe_drops = 0  # Writer thread: ffmpeg's pipe still held the previous frame
+        self.fps = 0.0  # Frame rate over the last FPS print
+        self._write_latencies = collections.deque(maxlen=256)  # Seconds from queued to written
+        self.last_zmq_print = self.start_time
+        # Timestamps are packed into one reused buffer instead of a new bytes object per frame
+        self._zmq_buf = bytearray(TIMESTAMP_MESSAGE.size)
+        self._zmq_view = memoryview(self._zmq_buf)
+        self._pack_timestamp_into = TIMESTAMP_MESSAGE.pack_into
+        
+        # Let ffmpeg open the camera and draw the fingerprint itself, so raw frames
+        # never pass through Python. The squares are switched through ffmpeg's zmq filter.
+        self.direct_capture = config['video'].get('direct_capture', False)
+        self.filter_port = config['network'].get('filter_port', self.video_port + 3)
         
-        # Create pipe for passing frames to ffmpeg
-        self.ffmpeg_cmd = None
+        # Pixel format frames are captured and piped in: "bgr24" (decoded by OpenCV) or
+        # "yuyv422" (raw from V4L2, no decode or colour conversion in Python)
+        self.capture_format = config['video'].get('capture_format', 'bgr24')
+        
+        # Use a hardware H.264 encoder if one works on this machine
+        self.hw_encoder = self._detect_hw_encoder()
+        
+        # Precomputed fingerprint region (96x64 pixels) for each of the 32 counter values
+        self._fp_tiles = self._build_fingerprint_tiles()
+        
+        # Everything the ffmpeg command depends on is known now, so build it once
+        self.ffmpeg_cmd = self._build_ffmpeg_cmd()
         self.ffmpeg_process = None
         
         # Initialize ZeroMQ context and publisher socket
@@ -42,13 +103,24 @@ class VideoStreamer:
             # Using a different port for ZMQ (video_port + 1)
             self.zmq_port = self.video_port + 1
             
+            # Queue at most one fingerprint cycle per subscriber: codes repeat every 32
+            # frames, so older timestamps could no longer be matched to a frame anyway.
+            # Set before binding so it applies to every subscriber connection.
+            self.zmq_socket.setsockopt(zmq.SNDHWM, 32)
+            
             # Use TCP wildcard address to bind to all interfaces
             bind_address = f"tcp://*:{self.zmq_port}"
             print(f"Attempting to bind ZeroMQ publisher to {bind_address}")
             self.zmq_socket.bind(bind_address)
             
-            # Set a high water mark for buffering (optional)
-            self.zmq_socket.setsockopt(zmq.SNDHWM, 1000)
+            # Also publish locally over IPC
+            self.zmq_ipc_address = None
+            if platform.system() != "Windows":
+                try:
+                    self.zmq_socket.bind(ZMQ_IPC_ADDRESS)
+                    self.zmq_ipc_address = ZMQ_IPC_ADDRESS
+                except zmq.ZMQError as e:
+                    print(f"Could not bind ZeroMQ publisher to {ZMQ_IPC_ADDRESS}: {e}")
             
             # Set linger period to 0 means to discard unsent messages on close
             self.zmq_socket.setsockopt(zmq.LINGER, 0)
@@ -60,6 +132,92 @@ class VideoStreamer:
             print(f"Error setting up ZeroMQ publisher: {e}")
             raise
             
+    @property
+    def dropped_frames(self):
+        """Frames not sent to ffmpeg because it was behind."""
+        return self._queue_drops + self._pipe_drops
+    
+    def _encoder_args(self, encoder):
+        """Return the ffmpeg output arguments for an H.264 encoder (None for libx264)."""
+        if encoder == "h264_videotoolbox":
+            return ["-c:v", "h264_videotoolbox", "-realtime", "1", "-allow_sw", "0"]
+        if encoder == "h264_nvenc":
+            # No B-frames or frame delay, so every frame leaves the encoder immediately
+            return ["-c:v", "h264_nvenc", "-preset", "p1", "-tune", "ll", "-zerolatency", "1", "-rc", "cbr",
+                    "-delay", "0", "-bf", "0"]
+        if encoder == "h264_vaapi":
+            # h264_vaapi defaults to two B-frames; constant bitrate matches the other encoders
+            return ["-c:v", "h264_vaapi", "-bf", "0", "-rc_mode", "CBR"]
+        return ["-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency"]
+    
+    def _encoder_filters(self, encoder):
+        """Return the video filters an H.264 encoder needs at the end of the filter chain."""
+        if encoder == "h264_vaapi":
+            return ["format=nv12", "hwupload"]
+        return []
+    
+    def _encoder_input_args(self, encoder):
+        """Return the ffmpeg global arguments an H.264 encoder needs before the input."""
+        if encoder == "h264_vaapi":
+            return ["-vaapi_device", VAAPI_DEVICE]
+        return []
+    
+    def _detect_hw_encoder(self):
+        """Return the first hardware H.264 encoder that can encode a test frame, or None."""
+        if platform.system() == "Darwin":
+            candidates = ["h264_videotoolbox"]
+        else:
+            candidates = ["h264_nvenc"]
+            if os.path.exists(VAAPI_DEVICE):
+                candidates.append("h264_vaapi")
+                
+        for encoder in candidates:
+            # Encoders can be compiled in without usable hardware, so try one frame
+            test_cmd = (
+                ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+                + self._encoder_input_args(encoder)
+                + ["-f", "lavfi", "-i", "color=black:s=256x256", "-frames:v", "1"]
+                + ["-vf", ",".join(self._encoder_filters(encoder) or ["null"])]
+                + self._encoder_args(encoder)
+                + ["-f", "null", "-"]
+            )
+            try:
+                result = subprocess.run(test_cmd, capture_output=True, timeout=10)
+                if result.returncode == 0:
+                    print(f"Using hardware encoder: {encoder}")
+                    return encoder
+            except Exception as e:
+                print(f"Could not test encoder {encoder}: {e}")
+                
+        print("Using software encoder: libx264")
+        return None
+    
+    def _build_fingerprint_tiles(self):
+        """Render the fingerprint squares for every counter value once."""
+        # Square value for every (code, bit), broadcast over each square's pixels
+        values = ((np.arange(32)[:, None] >> np.arange(5)) & 1).astype(np.uint8) * 255
+        luma = np.zeros((32, 96, 64), dtype=np.uint8)
+        for bit, (row, col) in enumerate(FINGERPRINT_SQUARES):
+            luma[:, row:row + 32, col:col + 32] = values[:, bit, None, None]
+        
+        if self.capture_format == 'yuyv422':
+            # Two bytes per pixel: luma, then alternating U/V chroma, kept neutral
+            tiles = np.full((32, 96, 64, 2), 128, dtype=np.uint8)
+            tiles[..., 0] = luma
+            return tiles
+        
+        # Materialized per channel: copying from a contiguous tile is much faster than
+        # from a broadcast view of the single-channel table
+        return np.repeat(luma[..., None], 3, axis=3)
+    
+    def _fingerprint_filters(self):
+        """Return the zmq and drawbox filters that draw the fingerprint inside ffmpeg."""
+        filters = [f"zmq=bind_address=tcp\\://127.0.0.1\\:{self.filter_port}"]
+        # Same square layout as process_frame: bit n of the counter is drawbox@fpn
+        for bit, (row, col) in enumerate(FINGERPRINT_SQUARES):
+            filters.append(f"drawbox@fp{bit}=x={col}:y={row}:w=32:h=32:color=black:t=fill")
+        return filters
+    
     def _print_local_ips(self):
         """Print local IP addresses for easier configuration"""
         import socket
@@ -77,6 +235,9 @@ class VideoStreamer:
         except Exception as e:
             print(f"Could not determine local IP addresses: {e}")
         
+        if self.zmq_ipc_address:
+            print(f"Viewers on this machine can connect to: {self.zmq_ipc_address}")
+        
     def setup_camera(self):
         """Set up the camera capture based on platform."""
         # Determine camera source based on platform
@@ -89,8 +250,24 @@ class VideoStreamer:
             camera_source = 0
             print("Detected Linux/Other, using camera index 0")
             
-        # Create video capture object
-        self.cap = cv2.VideoCapture(camera_source)
+        # Create video capture object; on Linux use V4L2 explicitly, which honours
+        # the buffer size below
+        if platform.system() == "Linux":
+            self.cap = cv2.VideoCapture(camera_source, cv2.CAP_V4L2)
+        else:
+            self.cap = cv2.VideoCapture(camera_source)
+        
+        # Keep a single frame queued in the driver, so each read returns the newest frame
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        
+        # Pick the pixel format before the resolution, as it limits the modes on offer
+        if self.capture_format == 'yuyv422':
+            # Ask V4L2 for raw YUYV and keep OpenCV from converting it to BGR
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        else:
+            # MJPEG keeps high resolutions at full frame rate within USB bandwidth
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
         
         # Set resolution
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
@@ -103,112 +280,321 @@ class VideoStreamer:
         if not self.cap.isOpened():
             print("Error: Could not open camera")
             return False
+        
+        if self.capture_format == 'yuyv422':
+            fourcc = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+            if fourcc != cv2.VideoWriter_fourcc(*'YUYV'):
+                print("Camera did not accept YUYV, capturing BGR instead")
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                self.capture_format = 'bgr24'
+                self._fp_tiles = self._build_fingerprint_tiles()
+                self.ffmpeg_cmd = self._build_ffmpeg_cmd()
             
         # Get actual camera properties (may differ from requested)
         actual_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         actual_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         actual_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        fourcc = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        actual_format = "".join(chr(fourcc >> shift & 0xFF) for shift in (0, 8, 16, 24))
         
-        print(f"Camera initialized with resolution: {actual_width}x{actual_height}, FPS: {actual_fps}")
+        print(f"Camera initialized with resolution: {actual_width}x{actual_height}, FPS: {actual_fps}, format: {actual_format}")
         return True
     
-    def setup_ffmpeg(self):
-        """Set up ffmpeg process for streaming the frames."""
-        ffmpeg_cmd = [
+    def _input_args(self):
+        """Return the ffmpeg input arguments: the camera itself, or raw frames on stdin."""
+        if not self.direct_capture:
+            return [
+                "-f", "rawvideo",
+                "-vcodec", "rawvideo",
+                "-pix_fmt", self.capture_format,
+                "-s", f"{self.width}x{self.height}",
+                "-r", str(self.framerate),
+                "-i", "-",  # Read from stdin
+            ]
+        if platform.system() == "Darwin":
+            # macOS - first AVFoundation video device
+            camera_format, camera_source = "avfoundation", "0"
+        else:
+            # Linux/Other - first V4L2 device
+            camera_format, camera_source = "v4l2", "/dev/video0"
+        return [
+            "-f", camera_format,
+            "-framerate", str(self.framerate),
+            "-video_size", f"{self.width}x{self.height}",
+            "-i", camera_source,
+        ]
+    
+    def _output_url(self):
+        """Return the URL ffmpeg sends the MPEG-TS stream to."""
+        if self.transport == 'srt':
+            # SRT retransmits lost packets within the latency budget (given in microseconds)
+            return (f"srt://{self.operator_ip}:{self.video_port}?mode=caller"
+                    f"&latency={self.srt_latency * 1000}&pkt_size=1316&transtype=live")
+        return f"udp://{self.operator_ip}:{self.video_port}?pkt_size=1316&buffer_size=7340032"
+    
+    def _build_ffmpeg_cmd(self):
+        """Return the ffmpeg command for the configured camera, encoder and transport."""
+        filters = self._encoder_filters(self.hw_encoder)
+        if self.direct_capture:
+            filters = self._fingerprint_filters() + filters
+        filter_args = ["-vf", ",".join(filters)] if filters else []
+        
+        return (
             "ffmpeg",
             "-y",  # Overwrite output file
-            "-f", "rawvideo",
-            "-vcodec", "rawvideo",
-            "-pix_fmt", "bgr24",
-            "-s", f"{self.width}x{self.height}",
-            "-r", str(self.framerate),
-            "-i", "-",  # Read from stdin
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-tune", "zerolatency",
+            "-hide_banner", "-nostats", "-loglevel", "warning",  # Only problems reach the terminal
+            *self._encoder_input_args(self.hw_encoder),
+            *self._input_args(),
+            *filter_args,
+            *self._encoder_args(self.hw_encoder),
             "-b:v", "1000k",
             "-minrate", "800k",
             "-maxrate", "1200k",
             "-bufsize", "1000k",
             "-g", str(self.framerate * 2),
             "-keyint_min", str(self.framerate),
+            "-flush_packets", "1",  # Hand each packet to the socket as soon as it is muxed
+            "-max_delay", "0",
+            "-muxpreload", "0",
             "-f", "mpegts",
-            f"udp://{self.operator_ip}:{self.video_port}?pkt_size=1316"
-        ]
-        
-        # Start ffmpeg process
+            self._output_url()
+        )
+    
+    def setup_ffmpeg(self):
+        """Set up ffmpeg process for streaming the frames."""
+        # Start ffmpeg process. Frames bypass the stdin file object, so it is left unbuffered;
+        # stderr goes to the terminal: a pipe that nobody reads would stall ffmpeg once full
         self.ffmpeg_process = subprocess.Popen(
-            ffmpeg_cmd,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            self.ffmpeg_cmd,
+            stdin=subprocess.DEVNULL if self.direct_capture else subprocess.PIPE,
+            bufsize=0
         )
         
+        # Frames are written straight to the pipe's file descriptor, without blocking.
+        # Ideally the pipe holds two frames, and ffmpeg is behind once a whole frame
+        # waits in it. pipe-max-size (1 MiB by default) is often smaller than that, and
+        # then ffmpeg is behind if any of the previous frame is still unread.
+        if not self.direct_capture:
+            self._ffmpeg_stdin_fd = self.ffmpeg_process.stdin.fileno()
+            bytes_per_pixel = 2 if self.capture_format == 'yuyv422' else 3
+            frame_bytes = self.width * self.height * bytes_per_pixel
+            pipe_size = self._set_pipe_size(self._ffmpeg_stdin_fd, 2 * frame_bytes)
+            if pipe_size is None:
+                self._backlog_limit = None  # Only a full pipe makes a frame drop
+            elif pipe_size >= 2 * frame_bytes:
+                self._backlog_limit = frame_bytes
+            else:
+                print(f"ffmpeg pipe holds {pipe_size} bytes, less than two frames ({2 * frame_bytes});"
+                      " raise /proc/sys/fs/pipe-max-size to queue whole frames")
+                self._backlog_limit = 1
+            os.set_blocking(self._ffmpeg_stdin_fd, False)
+        
         print(f"FFmpeg started, streaming to {self.operator_ip}:{self.video_port}")
         return True
     
-    def process_frame(self, frame):
+    def _set_pipe_size(self, fd, size):
+        """Resize a pipe's kernel buffer (Linux only), capped at the system maximum.
+        
+        Returns the size the pipe ended up with, or None if it is unknown.
+        """
+        if not sys.platform.startswith('linux'):
+            return None
+        
+        F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+        F_GETPIPE_SZ = getattr(fcntl, 'F_GETPIPE_SZ', 1032)
+        try:
+            with open('/proc/sys/fs/pipe-max-size', 'r') as file:
+                size = min(size, int(file.read()))
+            return fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+        except OSError as e:
+            print(f"Could not resize pipe: {e}")
+            return fcntl.fcntl(fd, F_GETPIPE_SZ)
+    
+    def _pipe_backlog(self, fd):
+        """Return how many bytes written to a pipe have not been read yet."""
+        return struct.unpack('i', fcntl.ioctl(fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+    
+    def process_frame(self, frame, capture_time=None):
         """Process frame before sending it (can be extended)."""
 
         # Add a fingerprint to the frame to identify later for latency measurement
         # This fingerprint is simply a global counter that keeps increasing for each frame, looping
-        # every 32 frames.
-        self.frame_count = (self.frame_count + 1) % 32
+        # every 32 frames. It is kept apart from the FPS counter, which resets every second.
+        self._fp_code = (self._fp_code + 1) & 31
+        self.frame_count += 1
         
         # Add the fingerprint to the frame as a binary code of either white or black squares.
-        # The code is five squares long, and 32x32 pixels.
-        frame[0:32, 0:32, :] = (self.frame_count >> 0 & 1) * 255
-        frame[0:32, 32:64, :] = (self.frame_count >> 1 & 1) * 255
-        frame[32:64, 0:32, :] = (self.frame_count >> 2 & 1) * 255
-        frame[32:64, 32:64, :] = (self.frame_count >> 3 & 1) * 255
-        frame[64:96, 0:32, :] = (self.frame_count >> 4 & 1) * 255
+        # The code is five squares long, and 32x32 pixels. The squares are copied from the
+        # precomputed tile; the unused sixth square (rows 64-96, columns 32-64) is left alone.
+        tile = self._fp_tiles[self._fp_code]
+        np.copyto(frame[0:64, 0:64, :], tile[0:64, :, :])
+        np.copyto(frame[64:96, 0:32, :], tile[64:96, 0:32, :])
 
+        self.send_timestamp(self._fp_code, capture_time)
+        
+        return frame
+    
+    def send_timestamp(self, code, current_time=None):
+        """Publish the fingerprint code shown on the current frame and the time it was sent
+        (or captured, if given)."""
         # Get current timestamp with millisecond precision
-        current_time = time.time()
+        if current_time is None:
+            current_time = time.time()
         
         # Send frame count and timestamp over ZeroMQ
         try:
-            message = {
-                "frame_count": self.frame_count,
-                "timestamp": current_time,
-                "frame_id": int(time.time() * 1000)  # Unique ID for this frame
-            }
-            
-            # Send as JSON string
-            json_msg = json.dumps(message)
-            self.zmq_socket.send_string(json_msg)
+            # Send as a fixed-size binary message, never waiting on a slow subscriber.
+            # Reusing the buffer is safe: pyzmq copies messages this small even with copy=False.
+            self._pack_timestamp_into(self._zmq_buf, 0, code, current_time, self.frame_count)
+            self.zmq_socket.send_multipart((TIMESTAMP_TOPIC, self._zmq_view), flags=zmq.NOBLOCK, copy=False)
             
             # Count sent messages
             self.zmq_messages_sent += 1
-            
-            # Print ZMQ stats every 5 seconds
-            if current_time - self.last_zmq_print >= 5.0:
-                rate = self.zmq_messages_sent / (current_time - self.last_zmq_print)
-                print(f"ZMQ: Sent {self.zmq_messages_sent} messages at {rate:.1f} msg/sec")
-                self.zmq_messages_sent = 0
-                self.last_zmq_print = current_time
                 
+        except zmq.Again:
+            pass  # Send queue full; drop this timestamp rather than stall capture
         except Exception as e:
             print(f"Error sending ZMQ message: {e}")
+    
+    def write_frame(self, frame):
+        """Write a frame to ffmpeg from the array's own memory, without a bytes copy.
         
-        return frame
+        Returns False, having written nothing, if ffmpeg is still behind on earlier
+        frames. Raises TimeoutError if ffmpeg stops reading partway through the frame.
+        """
+        fd = self._ffmpeg_stdin_fd
+        if self._backlog_limit and self._pipe_backlog(fd) >= self._backlog_limit:
+            return False
+        
+        # OpenCV frames are contiguous; anything else is packed once so it can be viewed as bytes
+        if not frame.flags['C_CONTIGUOUS']:
+            frame = np.ascontiguousarray(frame)
+        view = memoryview(frame).cast('B')
+        try:
+            written = os.write(fd, view)
+        except BlockingIOError:
+            return False
+        view = view[written:]
+        
+        # Once started, the frame must be finished or ffmpeg would lose frame alignment
+        while view:
+            _, writable, _ = select.select([], [fd], [], 2.0)
+            if not writable:
+                raise TimeoutError("ffmpeg stopped reading frames")
+            try:
+                written = os.write(fd, view)
+            except BlockingIOError:
+                continue
+            view = view[written:]
+        return True
     
-    def calculate_fps(self):
-        """Calculate and print the current FPS."""
-        current_time = time.time()
+    def calculate_fps(self, current_time=None):
+        """Calculate and print the current FPS (and the ZMQ send rate every 5 seconds).
+        
+        current_time is a time.monotonic() reading.
+        """
+        self._fps_frames += 1
+        if current_time is None:
+            current_time = time.monotonic()
         elapsed = current_time - self.start_time
         
         # Print FPS every second
         if current_time - self.last_fps_print >= 1.0:
-            fps = self.frame_count / elapsed
-            print(f"FPS: {fps:.2f}")
-            self.frame_count = 0
+            self.fps = self._fps_frames / elapsed
+            print(f"FPS: {self.fps:.2f} ({self.frame_count} frames streamed)")
+            self._fps_frames = 0
             self.start_time = current_time
             self.last_fps_print = current_time
+            
+            # Print ZMQ stats every 5 seconds
+            if current_time - self.last_zmq_print >= 5.0:
+                rate = self.zmq_messages_sent / (current_time - self.last_zmq_print)
+                print(f"ZMQ: Sent {self.zmq_messages_sent} messages at {rate:.1f} msg/sec")
+                print(f"Frames dropped because ffmpeg was behind: {self.dropped_frames}")
+                self.zmq_messages_sent = 0
+                self.last_zmq_print = current_time
+                self.send_stats()
+    
+    def send_stats(self):
+        """Publish pipeline stats: queue depths, dropped frames, write latency and FPS."""
+        # Snapshot first: the writer thread appends while this runs
+        latencies = self._write_latencies.copy()
+        stats = {
+            "read_q": self.read_q.qsize() if hasattr(self, 'read_q') else 0,
+            "write_q": self.write_q.qsize() if hasattr(self, 'write_q') else 0,
+            "dropped_frames": self.dropped_frames,
+            "write_latency_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+            "fps": round(self.fps, 2),
+        }
+        try:
+            self.zmq_socket.send_multipart((STATS_TOPIC, json.dumps(stats).encode()), flags=zmq.NOBLOCK)
+        except zmq.Again:
+            pass  # Send queue full; the next report follows in 5 seconds
+        except Exception as e:
+            print(f"Error sending ZMQ stats: {e}")
+    
+    def run_direct(self):
+        """Step the fingerprint drawn by ffmpeg once per frame interval."""
+        control = self.zmq_context.socket(zmq.REQ)
+        control.setsockopt(zmq.LINGER, 0)
+        control.setsockopt(zmq.RCVTIMEO, 2000)
+        control.connect(f"tcp://127.0.0.1:{self.filter_port}")
+        
+        shown = 0  # ffmpeg starts with every square black
+        interval = 1.0 / self.framerate
+        next_frame = time.monotonic()
+        try:
+            while self.running:
+                if self.ffmpeg_process.poll() is not None:
+                    print("Error: ffmpeg exited")
+                    break
+                    
+                self._fp_code = (self._fp_code + 1) & 31
+                self.frame_count += 1
+                
+                # Only the squares whose bit changed need a command
+                changed = shown ^ self._fp_code
+                for bit in range(5):
+                    if changed >> bit & 1:
+                        color = "white" if self._fp_code >> bit & 1 else "black"
+                        control.send_string(f"drawbox@fp{bit} color {color}")
+                        control.recv()
+                shown = self._fp_code
+                
+                # The new code shows on the next frame ffmpeg captures
+                self.send_timestamp(self._fp_code)
+                
+                now = time.monotonic()
+                self.calculate_fps(now)
+                
+                next_frame += interval
+                delay = next_frame - now
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = now
+        except zmq.Again:
+            print("Error: ffmpeg did not answer on the zmq filter port (is ffmpeg built with libzmq?)")
+        finally:
+            control.close()
     
     def start(self):
         """Start capturing and streaming."""
         self.running = True
         
+        if self.direct_capture:
+            if not self.setup_ffmpeg():
+                return False
+            print("Starting direct capture and stream...")
+            print(f"ZeroMQ metrics on port: {self.zmq_port} (connect to this from viewer)")
+            try:
+                self.run_direct()
+            except KeyboardInterrupt:
+                print("\nCapture interrupted by user")
+            finally:
+                self.stop()
+            return True
+        
         # Set up camera
         if not self.setup_camera():
             return False
@@ -221,24 +607,50 @@ class VideoStreamer:
         print("Starting capture and stream...")
         print(f"ZeroMQ metrics on port: {self.zmq_port} (connect to this from viewer)")
         
+        # Capture, processing and the ffmpeg write run as three stages, so the camera
+        # read and the pipe write overlap with stamping. The small queues bound memory;
+        # when ffmpeg falls behind the oldest queued frame is dropped, so latency stays bounded.
+        self.read_q = queue.Queue(maxsize=2)
+        self.write_q = queue.Queue(maxsize=2)
+        
+        # Capture buffers are reused: enough for both queues plus one frame in each
+        # stage. Each slot is allocated by the first retrieve() that uses it.
+        self.frame_pool = queue.Queue()
+        for _ in range(self.read_q.maxsize + self.write_q.maxsize + 3):
+            self.frame_pool.put(None)
+        
+        self.reader_thread = threading.Thread(target=self._capture_frames)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+        
+        self.writer_thread = threading.Thread(target=self._write_frames)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        
+        # Resolve the per-frame calls once, outside the processing loop
+        get_frame = self.read_q.get
+        process_frame = self.process_frame
+        calculate_fps = self.calculate_fps
+        queue_frame = self._put_dropping_oldest
+        now = time.monotonic
+        
         try:
             while self.running:
-                # Capture frame
-                ret, frame = self.cap.read()
-                
-                if not ret:
-                    print("Error: Could not read frame from camera")
-                    time.sleep(0.1)
+                # Take the next captured frame
+                try:
+                    frame, capture_time, buffer = get_frame(timeout=0.5)
+                except queue.Empty:
                     continue
                 
                 # Process the frame (modify as needed)
-                processed_frame = self.process_frame(frame)
+                processed_frame = process_frame(frame, capture_time)
                 
                 # Calculate and print FPS
-                self.calculate_fps()
+                current_time = now()
+                calculate_fps(current_time)
                 
-                # Send the frame to ffmpeg
-                self.ffmpeg_process.stdin.write(processed_frame.tobytes())
+                # Hand the frame to the writer stage, noting when it was queued
+                queue_frame((processed_frame, buffer, current_time))
                 
         except KeyboardInterrupt:
             print("\nCapture interrupted by user")
@@ -251,10 +663,128 @@ class VideoStreamer:
             
         return True
     
+    def _put_while_running(self, stage_queue, item):
+        """Queue an item for the next pipeline stage, giving up once streaming stops."""
+        while self.running:
+            try:
+                stage_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def _put_dropping_oldest(self, item):
+        """Queue a processed frame for the writer, dropping the oldest one if it is behind."""
+        try:
+            self.write_q.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        
+        # The writer may take the oldest frame first, in which case nothing is dropped
+        try:
+            _, oldest_buffer, _ = self.write_q.get_nowait()
+            self.frame_pool.put(oldest_buffer)
+            self._queue_drops += 1
+        except queue.Empty:
+            pass
+        
+        # This thread is the only producer, so there is room now
+        self.write_q.put_nowait(item)
+    
+    def _capture_frames(self):
+        """Reader stage: capture frames from the camera and queue them for processing."""
+        grab = self.cap.grab
+        retrieve = self.cap.retrieve
+        read_q_full = self.read_q.full
+        take_buffer = self.frame_pool.get_nowait
+        wall_clock = time.time
+        return_buffer = self.frame_pool.put
+        yuyv_shape = (self.height, self.width, 2) if self.capture_format == 'yuyv422' else None
+        
+        # An error here would otherwise end the thread silently and freeze the stream
+        try:
+            while self.running:
+                # Capture frame; the image is only decoded if it will be used
+                if not grab():
+                    print("Error: Could not read frame from camera")
+                    time.sleep(0.1)
+                    continue
+                capture_time = wall_clock()
+                
+                # Processing is behind: drop this frame rather than decode it
+                if read_q_full():
+                    continue
+                try:
+                    buffer = take_buffer()
+                except queue.Empty:
+                    continue  # Every buffer is still in the pipeline
+                
+                # Decode into the reused buffer (OpenCV reallocates it if the size changed)
+                ret, buffer = retrieve() if buffer is None else retrieve(buffer)
+                if not ret:
+                    return_buffer(None)
+                    continue
+                
+                # Raw YUYV comes back as a flat buffer of two bytes per pixel
+                frame = buffer.reshape(yuyv_shape) if yuyv_shape else buffer
+                
+                self._put_while_running(self.read_q, (frame, capture_time, buffer))
+        except Exception as e:
+            print(f"Error capturing frame: {e}")
+            self.running = False
+    
+    def _write_frames(self):
+        """Writer stage: send processed frames to ffmpeg until stopped or given None."""
+        get_frame = self.write_q.get
+        write_frame = self.write_frame
+        return_buffer = self.frame_pool.put
+        record_latency = self._write_latencies.append
+        now = time.monotonic
+        
+        while True:
+            try:
+                item = get_frame(timeout=0.5)
+            except queue.Empty:
+                if not self.running:
+                    break
+                continue
+            if item is None:
+                break
+            frame, buffer, queued_time = item
+                
+            try:
+                if write_frame(frame):
+                    record_latency(now() - queued_time)
+                else:
+                    # ffmpeg's pipe is still full: drop this frame rather than stall
+                    self._pipe_drops += 1
+                
+                # Written out or dropped, so the capture buffer can take another frame
+                return_buffer(buffer)
+            except OSError as e:
+                print(f"Error writing frame to ffmpeg: {e}")
+                self.running = False
+                break
+            except Exception as e:
+                print(f"Error in writer thread: {e}")
+                self.running = False
+                break
+    
     def stop(self):
         """Stop capturing and streaming."""
         self.running = False
         
+        # Let the pipeline stages finish before the camera and pipe are closed
+        if hasattr(self, 'write_q'):
+            try:
+                self.write_q.put_nowait(None)
+            except queue.Full:
+                pass  # The writer sees self.running once the queue drains
+        for thread in (getattr(self, 'reader_thread', None), getattr(self, 'writer_thread', None)):
+            if thread and thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=2)
+        
         # Close ZeroMQ socket
         if hasattr(self, 'zmq_socket'):
             try:
@@ -276,7 +806,8 @@ class VideoStreamer:
         # Stop ffmpeg
         if hasattr(self, 'ffmpeg_process'):
             try:
-                self.ffmpeg_process.stdin.close()
+                if self.ffmpeg_process.stdin:
+                    self.ffmpeg_process.stdin.close()
                 self.ffmpeg_process.terminate()
                 self.ffmpeg_process.wait(timeout=2)
             except:
@@ -286,8 +817,10 @@ class VideoStreamer:
 
 def load_config(config_path):
     """Load configuration from YAML file."""
+    # libyaml's C loader when PyYAML was built with it, else the pure-Python one
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(config_path, 'r') as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=loader)
 
 def main():
     parser = argparse.ArgumentParser(description='Stream webcam video using OpenCV and ffmpeg')